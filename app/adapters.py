@@ -1,81 +1,187 @@
 import abc
+import errno
 import os
 import shutil
 import subprocess
 import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from contextlib import contextmanager
 from dataclasses import dataclass
+from operator import attrgetter
 from pathlib import Path
-from typing import BinaryIO, Iterator
+from typing import Any, BinaryIO, Iterator
 import importlib.util
 import importlib
-from io import BytesIO
+import logging
 
-from app.process import start_background_process
+from app.process import read_stderr, start_background_process
 
-@dataclass(frozen=True)
+logger = logging.getLogger(__name__)
+
+INDEX_WORKERS = 16
+COPY_CHUNK_SIZE = 4 * 1024 * 1024
+MOUNT_TIMEOUT_SECONDS = 60.0
+COPY_WORKERS = 8
+
+
+@dataclass(frozen=True, slots=True)
 class DirEntry:
     name: str
     path: str
     is_dir: bool
     size: int | None
 
+    @property
+    def sort_key(self) -> tuple[bool, str]:
+        # Directories first, then by name ignoring case. Computed on demand:
+        # sorting calls it once per entry, and entries built from cached
+        # buckets for display never need it.
+        return (not self.is_dir, self.name.casefold())
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"name": self.name, "path": self.path, "is_dir": self.is_dir, "size": self.size}
+
+
+def _parallel_copytree(source: Path, destination: Path, workers: int = COPY_WORKERS) -> None:
+    # Like shutil.copytree, but the directory skeleton is created first and the
+    # files are then copied concurrently, overlapping per-file mount latency.
+    directories: list[tuple[Path, Path]] = []
+    sources: list[Path] = []
+    targets: list[Path] = []
+    # os.walk skips unreadable directories by default; a copy must not silently
+    # come out incomplete, so listing errors are raised like copytree does.
+    for current, _, filenames in os.walk(source, onerror=_reraise, followlinks=True):
+        source_dir = Path(current)
+        target_dir = destination / source_dir.relative_to(source)
+        target_dir.mkdir()
+        directories.append((source_dir, target_dir))
+        for name in filenames:
+            sources.append(source_dir / name)
+            targets.append(target_dir / name)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(shutil.copy2, sources, targets):
+            pass
+    # Applied last: creating the files would otherwise reset directory mtimes.
+    for source_dir, target_dir in directories:
+        shutil.copystat(source_dir, target_dir)
+
+
+def _reraise(error: OSError) -> None:
+    raise error
+
+
+def _copy_file_range(source: BinaryIO, target: BinaryIO) -> None:
+    # Large uploads are spooled to a temporary file by Werkzeug; copy those
+    # inside the kernel. Smaller streams may still be in memory (asking for
+    # their fileno would force them to disk) and are left to the caller, as
+    # is anything the filesystem refuses to copy this way.
+    if not hasattr(os, "copy_file_range") or not source.seekable():
+        return
+    offset = source.tell()
+    remaining = source.seek(0, os.SEEK_END) - offset
+    source.seek(offset)
+    if remaining < COPY_CHUNK_SIZE:
+        return
+    try:
+        source_fd = source.fileno()
+    except OSError:
+        return
+    copied = 0
+    try:
+        while copied < remaining:
+            count = os.copy_file_range(source_fd, target.fileno(), remaining - copied, offset + copied)
+            if count == 0:
+                break
+            copied += count
+    except OSError:
+        if copied:
+            raise
+    source.seek(offset + copied)
+
 
 class VaultAdapterError(RuntimeError):
     pass
 
 
 class VaultAdapter(abc.ABC):
-    def __init__(self, vault_path: Path) -> None:
+    def __init__(self, vault_path: Path, index_workers: int = INDEX_WORKERS) -> None:
         self.vault_path = vault_path
+        self.index_workers = index_workers
 
     @abc.abstractmethod
     @contextmanager
     def open(self, passphrase: str) -> Iterator[Path]:
         raise NotImplementedError
 
-    def list_dir(self, root: Path, relative_path: str) -> list[DirEntry]:
+    def list_dir(self, root: Path, relative_path: str, sort: bool = True) -> list[DirEntry]:
         target = root / relative_path.lstrip("/")
-        if not target.exists():
-            raise VaultAdapterError(f"Path does not exist: {relative_path}")
+        parent = relative_path.strip("/")
+        prefix = f"/{parent}/" if parent else "/"
         entries: list[DirEntry] = []
-        for entry in sorted(target.iterdir(), key=lambda item: (not item.is_dir(), item.name.lower())):
-            entries.append(
-                DirEntry(
-                    name=entry.name,
-                    path=f"/{relative_path.strip('/')}/{entry.name}".replace("//", "/"),
-                    is_dir=entry.is_dir(),
-                    size=entry.stat().st_size if entry.is_file() else None,
-                )
-            )
+        # DirEntry objects carry the file type from readdir, so only regular
+        # files need an extra stat (for their size).
+        try:
+            with os.scandir(target) as iterator:
+                for item in iterator:
+                    is_file = item.is_file()
+                    entries.append(
+                        DirEntry(
+                            name=item.name,
+                            path=prefix + item.name,
+                            is_dir=item.is_dir(),
+                            size=item.stat().st_size if is_file else None,
+                        )
+                    )
+        except (FileNotFoundError, NotADirectoryError) as exc:
+            raise VaultAdapterError(f"Path does not exist: {relative_path}") from exc
+        except OSError as exc:
+            raise VaultAdapterError(f"Failed to list {relative_path}: {exc.strerror or exc}") from exc
+        if sort:
+            entries.sort(key=attrgetter("sort_key"))
         return entries
 
-    def build_index(self, passphrase: str) -> dict[str, list[DirEntry]]:
-        with self.open(passphrase) as root:
-            root_entries = self.list_dir(root, "/")
-            index: dict[str, list[DirEntry]] = {"/": root_entries}
-            stack = [entry for entry in root_entries if entry.is_dir]
-            while stack:
-                entry = stack.pop()
-                children = self.list_dir(root, entry.path)
-                index[entry.path] = children
-                stack.extend(child for child in children if child.is_dir)
-            return index
-
-    def open_file(self, root: Path, relative_path: str) -> BinaryIO:
+    def index_tree(self, root: Path) -> dict[str, list[DirEntry]]:
+        index: dict[str, list[DirEntry]] = {}
+        # Listings block on (FUSE) syscalls, which release the GIL, so
+        # sibling directories are listed concurrently. Results are merged
+        # on this thread only, so the index needs no lock.
+        executor = ThreadPoolExecutor(max_workers=self.index_workers)
+        try:
+            pending = {executor.submit(self.list_dir, root, "/", False): "/"}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    children = future.result()
+                    index[path] = children
+                    for child in children:
+                        if child.is_dir:
+                            pending[executor.submit(self.list_dir, root, child.path, False)] = child.path
+        finally:
+            executor.shutdown(cancel_futures=True)
+        return index
+
+    def file_path(self, root: Path, relative_path: str) -> Path:
         target = root / relative_path.lstrip("/")
         if not target.is_file():
             raise VaultAdapterError(f"File not found: {relative_path}")
-        with open(target, "rb") as f:
-            file_data = BytesIO(f.read())
-        return file_data
+        return target
 
     def write_file(self, root: Path, relative_path: str, stream: BinaryIO) -> None:
         target = root / relative_path.lstrip("/")
         target.parent.mkdir(parents=True, exist_ok=True)
         with target.open("wb") as handle:
-            for chunk in iter(lambda: stream.read(1024 * 1024), b""):
-                handle.write(chunk)
+            _copy_file_range(stream, handle)
+            shutil.copyfileobj(stream, handle, length=COPY_CHUNK_SIZE)
+            handle.flush()
+            # The upload will not be read back soon; keep it from crowding out
+            # the page cache. Purely advisory, so failures are ignored.
+            if hasattr(os, "posix_fadvise"):
+                try:
+                    os.posix_fadvise(handle.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+                except OSError:
+                    pass
 
     def make_dir(self, root: Path, relative_path: str) -> None:
         target = root / relative_path.lstrip("/")
@@ -101,7 +207,14 @@ class VaultAdapter(abc.ABC):
         destination = dest_dir / source.name
         if destination.exists():
             raise VaultAdapterError(f"Destination already exists: {destination_dir}/{source.name}")
-        shutil.move(str(source), str(destination))
+        # Source and destination live on the same mount, so a plain rename
+        # suffices; shutil.move's copy fallback is only for cross-device moves.
+        try:
+            os.replace(source, destination)
+        except OSError as exc:
+            if exc.errno != errno.EXDEV:
+                raise
+            shutil.move(str(source), str(destination))
 
     def copy_entry(self, root: Path, source_path: str, destination_dir: str) -> None:
         source = root / source_path.lstrip("/")
@@ -113,10 +226,13 @@ class VaultAdapter(abc.ABC):
         destination = dest_dir / source.name
         if destination.exists():
             raise VaultAdapterError(f"Destination already exists: {destination_dir}/{source.name}")
-        if source.is_dir():
-            shutil.copytree(source, destination)
-        else:
-            shutil.copy2(source, destination)
+        try:
+            if source.is_dir():
+                _parallel_copytree(source, destination)
+            else:
+                shutil.copy2(source, destination)
+        except OSError as exc:
+            raise VaultAdapterError(f"Failed to copy {source_path}: {exc}") from exc
 
     def delete_entry(self, root: Path, source_path: str) -> None:
         source = root / source_path.lstrip("/")
@@ -129,8 +245,8 @@ class VaultAdapter(abc.ABC):
 
 
 class PyVaultAdapter(VaultAdapter):
-    def __init__(self, vault_path: Path) -> None:
-        super().__init__(vault_path)
+    def __init__(self, vault_path: Path, index_workers: int = INDEX_WORKERS) -> None:
+        super().__init__(vault_path, index_workers)
         self._module = None
 
     def _load_module(self) -> None:
@@ -147,8 +263,18 @@ class PyVaultAdapter(VaultAdapter):
 
 
 class CLIVaultAdapter(VaultAdapter):
-    def __init__(self, vault_path: Path, cli_path: str, mount_root: Path, mounter: str, umount_cli_path: str) -> None:
-        super().__init__(vault_path)
+    def __init__(
+        self,
+        vault_path: Path,
+        cli_path: str,
+        mount_root: Path,
+        mounter: str,
+        umount_cli_path: str,
+        index_workers: int = INDEX_WORKERS,
+        mount_timeout_seconds: float = MOUNT_TIMEOUT_SECONDS,
+    ) -> None:
+        super().__init__(vault_path, index_workers)
+        self.mount_timeout_seconds = mount_timeout_seconds
         self.cli_path = cli_path
         self.mount_root = mount_root
         self.mounter = mounter
@@ -171,8 +297,11 @@ class CLIVaultAdapter(VaultAdapter):
                "--password:env", "CRYPTOMATOR_PASSWORD",
                "--mounter", self.mounter,
                str(self.vault_path)]
-        result = start_background_process(cmd)        
-        return result
+        try:
+            process = start_background_process(cmd, startup_seconds=0)
+        except RuntimeError as exc:
+            raise VaultAdapterError(str(exc)) from exc
+        self._wait_until_mounted(process, mount_dir)
         # result = subprocess.run(
         #     cmd,
         #     check=False,
@@ -182,16 +311,34 @@ class CLIVaultAdapter(VaultAdapter):
         # if result.returncode != 0:
         #     raise VaultAdapterError(result.stderr.strip() or "Failed to unlock vault")
 
+    def _wait_until_mounted(self, process: subprocess.Popen, mount_dir: Path) -> None:
+        # Poll with exponential backoff so a fast mount is picked up within
+        # milliseconds and a failing CLI is reported as soon as it exits.
+        deadline = time.monotonic() + self.mount_timeout_seconds
+        delay = 0.005
+        while not os.path.ismount(mount_dir):
+            if process.poll() is not None:
+                raise VaultAdapterError(read_stderr(process).strip() or "Failed to unlock vault")
+            if time.monotonic() >= deadline:
+                process.kill()
+                process.wait()
+                raise VaultAdapterError("Timed out waiting for the vault to mount")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.2)
+
     def _unmount(self, mount_dir: Path) -> None:
-        subprocess.run(
+        result = subprocess.run(
             [self.umount_cli_path, str(mount_dir)],
             check=False,
             capture_output=True,
             text=True,
         )
+        # Anything under a mountpoint that is still live (e.g. EBUSY while a
+        # download is open) is vault content: leave it alone entirely.
+        if os.path.ismount(mount_dir):
+            logger.warning("Could not unmount %s: %s", mount_dir, result.stderr.strip() or result.returncode)
+            return
         try:
-            for child in mount_dir.iterdir():
-                if child.is_file():
-                    child.unlink(missing_ok=True)
-        finally:
             mount_dir.rmdir()
+        except OSError as exc:
+            logger.warning("Could not remove mountpoint %s: %s", mount_dir, exc)
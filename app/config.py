@@ -18,12 +18,16 @@ class AppConfig:
     max_upload_mb: int
     enable_login_index_cache: bool
     index_cache_mode: str
+    index_cache_ttl_seconds: int
+    index_cache_dir: Path | None
     adapter: str
     cryptomator_cli_path: str
     umount_cli_path: str
     vault_mount_root: Path
     vaults: dict[str, VaultConfig]
     mounter: str
+    index_workers: int
+    mount_timeout_seconds: float
 
 def _load_vaults_config(path: Path) -> dict[str, VaultConfig]:
     if not path.exists():
@@ -49,11 +53,15 @@ def load_config() -> AppConfig:
         max_upload_mb=int(os.environ.get("MAX_UPLOAD_MB", "2048")),
         enable_login_index_cache=os.environ.get("ENABLE_LOGIN_INDEX_CACHE", "true").lower()
         == "true",
-        index_cache_mode=os.environ.get("INDEX_CACHE_MODE", "recursive"),
+        index_cache_mode=os.environ.get("INDEX_CACHE_MODE", "lazy").lower(),
+        index_cache_ttl_seconds=int(os.environ.get("INDEX_CACHE_TTL_SECONDS", "60")),
+        index_cache_dir=Path(os.environ["INDEX_CACHE_DIR"]) if os.environ.get("INDEX_CACHE_DIR") else None,
         adapter=os.environ.get("ADAPTER", "cli").lower(),
         cryptomator_cli_path=os.environ.get("CRYPTOMATOR_CLI_PATH", "/usr/bin/cryptomator-cli"),
         umount_cli_path=os.environ.get("UMOUNT_CLI_PATH", "/usr/bin/umount"), # not yet a windows equivalent tested
         vault_mount_root=Path(os.environ.get("VAULT_MOUNT_ROOT", "/tmp/mounts")),
         vaults=vaults,
-        mounter=os.environ.get("MOUNTER", "org.cryptomator.frontend.fuse.mount.LinuxFuseMountProvider")
+        mounter=os.environ.get("MOUNTER", "org.cryptomator.frontend.fuse.mount.LinuxFuseMountProvider"),
+        index_workers=max(1, int(os.environ.get("INDEX_WORKERS", "16"))),
+        mount_timeout_seconds=float(os.environ.get("MOUNT_TIMEOUT_SECONDS", "60")),
     )
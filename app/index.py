@@ -0,0 +1,225 @@
+from array import array
+from bisect import bisect_left
+from operator import attrgetter
+from threading import Lock
+from typing import Any, Callable, Iterable, Iterator, MutableMapping, Sequence
+
+from cachetools import TTLCache
+
+from app.adapters import DirEntry
+from app.utils import join_path
+
+LAZY_INDEX_MAX_DIRS = 4096
+
+
+class IndexBucket(Sequence[DirEntry]):
+    """Sorted listing of one directory, stored as parallel columns.
+
+    Paths are derived from the parent; DirEntry objects are built on read.
+    Once handed out by SessionIndex a bucket is never modified: changes are
+    made to a copy that replaces it, so readers need no lock.
+    """
+
+    __slots__ = ("parent", "names", "is_dir", "sizes")
+
+    def __init__(self, parent: str, entries: Iterable[DirEntry] = ()) -> None:
+        self.parent = parent
+        self.names: list[str] = []
+        self.is_dir = bytearray()
+        # -1 stands for "unknown size" (directories, fresh uploads).
+        self.sizes = array("q")
+        # Sorted once here, so callers list directories with sort=False.
+        for entry in sorted(entries, key=attrgetter("sort_key")):
+            self._append(entry)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, index: int | slice) -> DirEntry | list[DirEntry]:
+        if isinstance(index, slice):
+            return [self._entry(i) for i in range(*index.indices(len(self.names)))]
+        if index < 0:
+            index += len(self.names)
+        if not 0 <= index < len(self.names):
+            raise IndexError("bucket index out of range")
+        return self._entry(index)
+
+    def __iter__(self) -> Iterator[DirEntry]:
+        for i in range(len(self.names)):
+            yield self._entry(i)
+
+    def insert(self, entry: DirEntry) -> None:
+        position = bisect_left(range(len(self.names)), entry.sort_key, key=self._key)
+        size = -1 if entry.size is None else entry.size
+        # Names differing only in case share a key; an exact match means the
+        # entry was overwritten (e.g. a re-upload) and is updated in place.
+        for i in range(position, len(self.names)):
+            if self._key(i) != entry.sort_key:
+                break
+            if self.names[i] == entry.name:
+                self.sizes[i] = size
+                return
+        self.names.insert(position, entry.name)
+        self.is_dir.insert(position, entry.is_dir)
+        self.sizes.insert(position, size)
+
+    def find(self, name: str) -> DirEntry | None:
+        i = self._position(name)
+        return None if i is None else self._entry(i)
+
+    def remove(self, name: str) -> DirEntry | None:
+        i = self._position(name)
+        if i is None:
+            return None
+        entry = self._entry(i)
+        del self.names[i]
+        del self.is_dir[i]
+        del self.sizes[i]
+        return entry
+
+    def clone(self, parent: str) -> "IndexBucket":
+        bucket = IndexBucket(parent)
+        bucket.names = self.names.copy()
+        bucket.is_dir = bytearray(self.is_dir)
+        bucket.sizes = array("q", self.sizes)
+        return bucket
+
+    def to_dicts(self) -> list[dict[str, Any]]:
+        # Built straight from the columns; no DirEntry is materialized.
+        parent = self.parent
+        return [
+            {"name": name, "path": join_path(parent, name), "is_dir": bool(is_dir), "size": None if size < 0 else size}
+            for name, is_dir, size in zip(self.names, self.is_dir, self.sizes)
+        ]
+
+    def _append(self, entry: DirEntry) -> None:
+        self.names.append(entry.name)
+        self.is_dir.append(entry.is_dir)
+        self.sizes.append(-1 if entry.size is None else entry.size)
+
+    def _entry(self, i: int) -> DirEntry:
+        name = self.names[i]
+        size = self.sizes[i]
+        return DirEntry(
+            name=name,
+            path=join_path(self.parent, name),
+            is_dir=bool(self.is_dir[i]),
+            size=None if size < 0 else size,
+        )
+
+    def _position(self, name: str) -> int | None:
+        try:
+            return self.names.index(name)
+        except ValueError:
+            return None
+
+    def _key(self, i: int) -> tuple[bool, str]:
+        return (not self.is_dir[i], self.names[i].casefold())
+
+
+class SessionIndex:
+    """Directory listings cached for one session.
+
+    With a TTL, listings are memoized on first visit and expire (LRU-bounded);
+    without one, the index holds a full prebuilt crawl for the whole session.
+    """
+
+    def __init__(self, ttl_seconds: float | None = None, maxsize: int = LAZY_INDEX_MAX_DIRS) -> None:
+        self._lock = Lock()
+        self._buckets: MutableMapping[str, IndexBucket]
+        if ttl_seconds:
+            self._buckets = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        else:
+            self._buckets = {}
+
+    def get(self, path: str, loader: Callable[[str], Iterable[DirEntry]] | None = None) -> IndexBucket | None:
+        with self._lock:
+            bucket = self._buckets.get(path)
+        if bucket is not None or loader is None:
+            return bucket
+        # Listed outside the lock so a slow directory does not block the others.
+        bucket = IndexBucket(path, loader(path))
+        with self._lock:
+            # A concurrent request may have filled it meanwhile; keep the first.
+            return self._buckets.setdefault(path, bucket)
+
+    def put(self, path: str, bucket: IndexBucket) -> None:
+        with self._lock:
+            self._buckets[path] = bucket
+
+    def update(self, buckets: dict[str, IndexBucket]) -> None:
+        with self._lock:
+            self._buckets.update(buckets)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+    def add(self, directory: str, entry: DirEntry) -> None:
+        with self._lock:
+            self._edit(directory, lambda bucket: bucket.insert(entry))
+
+    def remove(self, path: str) -> None:
+        parent, name = _split(path)
+        with self._lock:
+            self._edit(parent, lambda bucket: bucket.remove(name))
+            for key in self._subtree(path):
+                self._buckets.pop(key, None)
+
+    def move(self, source: str, destination_dir: str) -> None:
+        parent, name = _split(source)
+        destination = join_path(destination_dir, name)
+        with self._lock:
+            self._link(destination_dir, self._edit(parent, lambda bucket: bucket.remove(name)))
+            # Buckets only store their own path, so re-keying a subtree is a
+            # copy of each cached listing under its new parent.
+            for key in self._subtree(source):
+                moved = self._buckets.pop(key, None)
+                if moved is not None:
+                    parent_path = destination + key[len(source):]
+                    self._buckets[parent_path] = moved.clone(parent_path)
+
+    def copy(self, source: str, destination_dir: str) -> None:
+        parent, name = _split(source)
+        destination = join_path(destination_dir, name)
+        with self._lock:
+            bucket = self._buckets.get(parent)
+            self._link(destination_dir, bucket.find(name) if bucket is not None else None)
+            for key in self._subtree(source):
+                original = self._buckets.get(key)
+                if original is not None:
+                    copied = original.clone(destination + key[len(source):])
+                    self._buckets[copied.parent] = copied
+
+    def _edit(self, directory: str, change: Callable[[IndexBucket], Any]) -> Any:
+        # Copy-on-write: readers keep the bucket they already hold.
+        bucket = self._buckets.get(directory)
+        if bucket is None:
+            return None
+        edited = bucket.clone(directory)
+        result = change(edited)
+        self._buckets[directory] = edited
+        return result
+
+    def _link(self, directory: str, entry: DirEntry | None) -> None:
+        if directory not in self._buckets:
+            return
+        if entry is None:
+            # The source listing was not cached, so the entry's kind and size
+            # are unknown: let the destination be listed again on next visit.
+            self._buckets.pop(directory, None)
+            return
+        self._edit(directory, lambda bucket: bucket.insert(entry))
+
+    def _subtree(self, path: str) -> list[str]:
+        prefix = path + "/"
+        return [key for key in self._buckets if key == path or key.startswith(prefix)]
+
+
+def _split(path: str) -> tuple[str, str]:
+    parent, _, name = path.rpartition("/")
+    return parent or "/", name
+
+
+def pack_index(index: dict[str, list[DirEntry]]) -> dict[str, IndexBucket]:
+    return {path: IndexBucket(path, entries) for path, entries in index.items()}
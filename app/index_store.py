@@ -0,0 +1,114 @@
+import hashlib
+import os
+import secrets
+import tempfile
+from array import array
+from pathlib import Path
+from threading import Lock
+from typing import Mapping
+
+import orjson
+from Crypto.Cipher import AES
+
+from app.index import IndexBucket
+
+MAGIC = b"CVSIDX2\n"
+SALT_SIZE = 16
+NONCE_SIZE = 12
+TAG_SIZE = 16
+# A stored index lets anyone who can read it test passphrase guesses offline,
+# so it must cost more per guess than the vault's own masterkey (scrypt
+# N=2**15, r=8). Paid once per load or save at login.
+SCRYPT_N = 2**16
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_MAXMEM = 2 * 128 * SCRYPT_R * SCRYPT_N
+
+
+class IndexStore:
+    """Recursive vault indexes kept on disk across restarts.
+
+    Files are named after the vault and encrypted (AES-GCM) with a key derived
+    from its passphrase, so they reveal nothing about the vault's contents.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self._lock = Lock()
+        # Bumped by every discard(); a crawl started before a write must not be
+        # saved after it.
+        self._generations: dict[str, int] = {}
+
+    def generation(self, vault_path: str) -> int:
+        with self._lock:
+            return self._generations.get(vault_path, 0)
+
+    def load(self, vault_path: str, passphrase: str) -> dict[str, IndexBucket] | None:
+        try:
+            blob = self._path(vault_path).read_bytes()
+        except OSError:
+            return None
+        header_size = len(MAGIC) + SALT_SIZE + NONCE_SIZE
+        if len(blob) < header_size + TAG_SIZE or not blob.startswith(MAGIC):
+            return None
+        salt = blob[len(MAGIC):len(MAGIC) + SALT_SIZE]
+        nonce = blob[len(MAGIC) + SALT_SIZE:header_size]
+        cipher = AES.new(_derive_key(passphrase, salt), AES.MODE_GCM, nonce=nonce)
+        cipher.update(blob[:header_size])
+        try:
+            payload = cipher.decrypt_and_verify(blob[header_size:-TAG_SIZE], blob[-TAG_SIZE:])
+        except ValueError:
+            # Tampered, or written under a passphrase that has since changed.
+            return None
+        buckets = {}
+        for path, (names, is_dir, sizes) in orjson.loads(payload).items():
+            bucket = IndexBucket(path)
+            bucket.names = names
+            bucket.is_dir = bytearray(is_dir)
+            bucket.sizes = array("q", sizes)
+            buckets[path] = bucket
+        return buckets
+
+    def save(self, vault_path: str, passphrase: str, buckets: Mapping[str, IndexBucket], generation: int) -> None:
+        payload = orjson.dumps(
+            {path: [bucket.names, list(bucket.is_dir), bucket.sizes.tolist()] for path, bucket in buckets.items()}
+        )
+        salt = secrets.token_bytes(SALT_SIZE)
+        nonce = secrets.token_bytes(NONCE_SIZE)
+        header = MAGIC + salt + nonce
+        cipher = AES.new(_derive_key(passphrase, salt), AES.MODE_GCM, nonce=nonce)
+        cipher.update(header)
+        ciphertext, tag = cipher.encrypt_and_digest(payload)
+        # The stored copy is only an optimization: failing to write it is not an error.
+        try:
+            self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".index-")
+        except OSError:
+            return
+        # Written next to the target and renamed over it, so a reader never
+        # sees a partial file.
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(header + ciphertext + tag)
+            with self._lock:
+                if self._generations.get(vault_path, 0) != generation:
+                    # The vault was written to while this index was crawled.
+                    Path(temp_path).unlink(missing_ok=True)
+                    return
+                os.replace(temp_path, self._path(vault_path))
+        except OSError:
+            Path(temp_path).unlink(missing_ok=True)
+
+    def discard(self, vault_path: str) -> None:
+        with self._lock:
+            self._generations[vault_path] = self._generations.get(vault_path, 0) + 1
+            self._path(vault_path).unlink(missing_ok=True)
+
+    def _path(self, vault_path: str) -> Path:
+        return self.directory / f"{hashlib.sha256(vault_path.encode('utf-8')).hexdigest()}.index"
+
+
+def _derive_key(passphrase: str, salt: bytes) -> bytes:
+    return hashlib.scrypt(
+        passphrase.encode("utf-8"), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, maxmem=SCRYPT_MAXMEM, dklen=32
+    )
@@ -1,15 +1,33 @@
+import atexit
+import hashlib
 import os
-from dataclasses import asdict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Iterator, Sequence
 
+import orjson
 from flask import Flask, Response, abort, flash, redirect, render_template, request, send_file, url_for
 
 from app.adapters import CLIVaultAdapter, DirEntry, PyVaultAdapter, VaultAdapter, VaultAdapterError
-from app.config import load_config
+from app.config import AppConfig, load_config
+from app.index import IndexBucket, SessionIndex, pack_index
+from app.index_store import IndexStore
+from app.mounts import MountManager
 from app.rate_limit import RateLimiter
 from app.session import SessionStore
-from app.utils import build_breadcrumbs, build_tree, flatten_tree, normalize_path
+from app.utils import build_breadcrumbs, build_tree, flatten_tree, join_path, normalize_path
+
+LIST_PAGE_SIZE = 200
+MAX_LIST_PAGE_SIZE = 1000
+STATUS_ERRORS = (
+    "No file uploaded",
+    "Invalid file name",
+    "Folder name is required",
+    "Folder name must be a single directory name",
+    "Folder already exists",
+    "Select at least one item and a destination folder",
+    "Select at least one item to delete",
+)
 
 
 def create_app() -> Flask:
@@ -19,19 +37,30 @@ def create_app() -> Flask:
     config = load_config()
     app.config["MAX_CONTENT_LENGTH"] = config.max_upload_mb * 1024 * 1024
 
-    session_store = SessionStore(secret_key=config.secret_key, ttl_seconds=config.session_ttl_seconds)
     rate_limiter = RateLimiter(max_attempts=5, window_seconds=300)
 
-    def get_adapter(vault_path: str) -> VaultAdapter:
-        if config.adapter == "cli":
-            return CLIVaultAdapter(
-                vault_path=Path(vault_path),
-                cli_path=config.cryptomator_cli_path,
-                mount_root=config.vault_mount_root,
-                mounter=config.mounter,
-                umount_cli_path=config.umount_cli_path,
-            )
-        return PyVaultAdapter(Path(vault_path))
+    index_store = IndexStore(config.index_cache_dir) if config.index_cache_dir else None
+
+    mounts = MountManager(lambda session: session_adapter(session, config))
+    atexit.register(mounts.release_all)
+    session_store = SessionStore(
+        secret_key=config.secret_key,
+        ttl_seconds=config.session_ttl_seconds,
+        on_remove=lambda session: mounts.release(session.session_id),
+    )
+
+    @contextmanager
+    def vault_write(session: Any) -> Iterator[None]:
+        # The stored index is dropped before writing, so a failure halfway cannot
+        # leave a stale copy, and again afterwards, so a login crawl that
+        # overlapped the write is not saved.
+        if index_store:
+            index_store.discard(session.data["vault_path"])
+        try:
+            yield
+        finally:
+            if index_store:
+                index_store.discard(session.data["vault_path"])
 
     def load_session() -> tuple[Any, bool]:
         session = session_store.get(request.cookies.get("session"))
@@ -49,10 +78,14 @@ def create_app() -> Flask:
     @app.context_processor
     def inject_vault_name() -> dict[str, str | None]:
         session = getattr(request, "session", None)
-        vault_name = None
-        if session:
-            vault_name = session.data.get("vault_id")
-        return {"vault_name": vault_name}
+        return {"vault_name": session.data.get("vault_id") if session else None}
+
+    # Fixed validation errors always render to the same markup; render them once.
+    with app.test_request_context():
+        status_errors = {
+            message: render_template("partials/status.html", status=message, status_level="error")
+            for message in STATUS_ERRORS
+        }
 
     @app.get("/login")
     def login() -> str:
@@ -72,18 +105,6 @@ def create_app() -> Flask:
             flash("Invalid vault selection", "error")
             return redirect(url_for("login"))
 
-        adapter = get_adapter(str(vault.path))
-        try:
-            index = None
-            if config.enable_login_index_cache:
-                index = adapter.build_index(passphrase)
-            else:
-                with adapter.open(passphrase) as root:
-                    adapter.list_dir(root, "/")
-        except VaultAdapterError as exc:
-            flash(str(exc), "error")
-            return redirect(url_for("login"))
-
         session = session_store.create()
         session.data.update(
             {
@@ -93,8 +114,34 @@ def create_app() -> Flask:
                 "index": None,
             }
         )
-        if config.enable_login_index_cache:
-            session.data["index"] = index
+        adapter = session_adapter(session, config)
+        try:
+            # The mount made here is kept for the rest of the session.
+            root = mounts.acquire(session)
+            if not config.enable_login_index_cache:
+                adapter.list_dir(root, "/", sort=False)
+            elif config.index_cache_mode == "recursive":
+                index = SessionIndex()
+                # A stored index only decrypts with the passphrase that was just
+                # verified by mounting; otherwise the vault is crawled again.
+                buckets = index_store.load(str(vault.path), passphrase) if index_store else None
+                if buckets is None:
+                    generation = index_store.generation(str(vault.path)) if index_store else 0
+                    buckets = pack_index(adapter.index_tree(root))
+                    if index_store:
+                        index_store.save(str(vault.path), passphrase, buckets, generation)
+                index.update(buckets)
+                session.data["index"] = index
+            else:
+                # Lazy mode: only the root listing (which also verifies the
+                # unlock) is cached now; other directories on first visit.
+                index = SessionIndex(ttl_seconds=config.index_cache_ttl_seconds)
+                index.put("/", IndexBucket("/", adapter.list_dir(root, "/", sort=False)))
+                session.data["index"] = index
+        except VaultAdapterError as exc:
+            session_store.destroy(session.session_id)
+            flash(str(exc), "error")
+            return redirect(url_for("login"))
 
         response = redirect(url_for("browse"))
         response.set_cookie(
@@ -122,10 +169,10 @@ def create_app() -> Flask:
     def browse_path(path: str | None = None) -> str:
         session = request.session
         path = normalize_path(path or request.args.get("path", "/"))
-        entries = list_entries(session, path)
+        entries = list_entries(session, path, config, mounts)
         tree = None
         if session.data.get("index"):
-            tree = build_tree_from_index(session.data["index"])
+            tree = build_tree_from_index(session.data["index"], directory_loader(session, config, mounts))
         return render_template(
             "browser.html",
             current_path=path,
@@ -135,11 +182,19 @@ def create_app() -> Flask:
         )
 
     @app.get("/hx/list")
-    def hx_list() -> str:
+    def hx_list() -> Response:
         session = request.session
         path = normalize_path(request.args.get("path", "/"))
-        entries = list_entries(session, path)
-        return render_template("partials/file_list.html", current_path=path, entries=entries)
+        offset = max(0, request.args.get("offset", 0, type=int))
+        limit = min(max(1, request.args.get("limit", LIST_PAGE_SIZE, type=int)), MAX_LIST_PAGE_SIZE)
+        entries = list_entries(session, path, config, mounts)
+        # Follow-up pages are appended to the existing list by the sentinel row.
+        template = "partials/file_rows.html" if offset else "partials/file_list.html"
+        return conditional_response(
+            listing_etag(path, entries, "hx", offset, limit),
+            lambda: render_template(template, current_path=path, **list_page(entries, offset, limit)),
+            mimetype="text/html",
+        )
 
     @app.post("/hx/upload")
     def hx_upload() -> str:
@@ -147,22 +202,27 @@ def create_app() -> Flask:
         path = normalize_path(request.args.get("path", "/"))
         upload = request.files.get("file")
         if not upload:
-            return render_template("partials/status.html", status="No file uploaded", status_level="error")
-
-        adapter = get_adapter(session.data["vault_path"])
+            return status_errors["No file uploaded"]
+        # Only the last component of the client-supplied name is used, so the
+        # file always lands in the current folder.
+        filename = upload.filename.rsplit("/", 1)[-1]
+        if filename in {"", ".", ".."}:
+            return status_errors["Invalid file name"]
+
+        adapter = session_adapter(session, config)
         try:
-            with adapter.open(session.data["passphrase"]) as root:
-                target_path = f"{path.rstrip('/')}/{upload.filename}".replace("//", "/")
-                adapter.write_file(root, target_path, upload.stream)
+            root = mounts.acquire(session)
+            with vault_write(session):
+                adapter.write_file(root, join_path(path, filename), upload.stream)
         except VaultAdapterError as exc:
             return render_template("partials/status.html", status=str(exc), status_level="error")
 
-        update_index_after_upload(session, path, upload.filename)
-        entries = list_entries(session, path)
+        update_index_after_upload(session, path, filename)
+        entries = list_entries(session, path, config, mounts)
         return render_template(
             "partials/action_result.html",
             current_path=path,
-            entries=entries,
+            **list_page(entries),
             status="Upload complete",
             status_level="success",
         )
@@ -173,30 +233,27 @@ def create_app() -> Flask:
         path = normalize_path(request.args.get("path", "/"))
         folder_name = (request.form.get("folder_name") or "").strip()
         if not folder_name:
-            return render_template("partials/status.html", status="Folder name is required", status_level="error")
+            return status_errors["Folder name is required"]
         if "/" in folder_name or folder_name in {".", ".."}:
-            return render_template(
-                "partials/status.html",
-                status="Folder name must be a single directory name",
-                status_level="error",
-            )
+            return status_errors["Folder name must be a single directory name"]
 
-        adapter = get_adapter(session.data["vault_path"])
-        new_folder_path = f"{path.rstrip('/')}/{folder_name}".replace("//", "/")
+        adapter = session_adapter(session, config)
+        new_folder_path = join_path(path, folder_name)
         try:
-            with adapter.open(session.data["passphrase"]) as root:
+            root = mounts.acquire(session)
+            with vault_write(session):
                 adapter.make_dir(root, new_folder_path)
         except VaultAdapterError as exc:
             return render_template("partials/status.html", status=str(exc), status_level="error")
         except FileExistsError:
-            return render_template("partials/status.html", status="Folder already exists", status_level="error")
+            return status_errors["Folder already exists"]
 
         update_index_after_mkdir(session, path, folder_name)
-        entries = list_entries(session, path)
+        entries = list_entries(session, path, config, mounts)
         return render_template(
             "partials/action_result.html",
             current_path=path,
-            entries=entries,
+            **list_page(entries),
             status="Folder created",
             status_level="success",
         )
@@ -208,34 +265,26 @@ def create_app() -> Flask:
         destination_input = (request.form.get("destination_dir") or "").strip()
         selected_paths = request.form.getlist("selected_paths")
         if not selected_paths or not destination_input:
-            return render_template(
-                "partials/status.html",
-                status="Select at least one item and a destination folder",
-                status_level="error",
-            )
+            return status_errors["Select at least one item and a destination folder"]
 
-        destination_dir = normalize_path(
-            destination_input if destination_input.startswith("/") else f"{current_path.rstrip('/')}/{destination_input}"
-        )
-        sources = [
-            normalize_path(path if path.startswith("/") else f"{current_path.rstrip('/')}/{path}")
-            for path in selected_paths
-        ]
+        destination_dir = normalize_path(join_path(current_path, destination_input))
+        sources = [normalize_path(join_path(current_path, path)) for path in selected_paths]
 
-        adapter = get_adapter(session.data["vault_path"])
+        adapter = session_adapter(session, config)
         try:
-            with adapter.open(session.data["passphrase"]) as root:
+            root = mounts.acquire(session)
+            with vault_write(session):
                 for source_path in sources:
                     adapter.move_entry(root, source_path, destination_dir)
+                    update_index_after_move(session, source_path, destination_dir)
         except VaultAdapterError as exc:
             return render_template("partials/status.html", status=str(exc), status_level="error")
 
-        refresh_index(session)
-        entries = list_entries(session, current_path)
+        entries = list_entries(session, current_path, config, mounts)
         return render_template(
             "partials/action_result.html",
             current_path=current_path,
-            entries=entries,
+            **list_page(entries),
             status="Items moved",
             status_level="success",
         )
@@ -247,34 +296,26 @@ def create_app() -> Flask:
         destination_input = (request.form.get("destination_dir") or "").strip()
         selected_paths = request.form.getlist("selected_paths")
         if not selected_paths or not destination_input:
-            return render_template(
-                "partials/status.html",
-                status="Select at least one item and a destination folder",
-                status_level="error",
-            )
+            return status_errors["Select at least one item and a destination folder"]
 
-        destination_dir = normalize_path(
-            destination_input if destination_input.startswith("/") else f"{current_path.rstrip('/')}/{destination_input}"
-        )
-        sources = [
-            normalize_path(path if path.startswith("/") else f"{current_path.rstrip('/')}/{path}")
-            for path in selected_paths
-        ]
+        destination_dir = normalize_path(join_path(current_path, destination_input))
+        sources = [normalize_path(join_path(current_path, path)) for path in selected_paths]
 
-        adapter = get_adapter(session.data["vault_path"])
+        adapter = session_adapter(session, config)
         try:
-            with adapter.open(session.data["passphrase"]) as root:
+            root = mounts.acquire(session)
+            with vault_write(session):
                 for source_path in sources:
                     adapter.copy_entry(root, source_path, destination_dir)
+                    update_index_after_copy(session, source_path, destination_dir)
         except VaultAdapterError as exc:
             return render_template("partials/status.html", status=str(exc), status_level="error")
 
-        refresh_index(session)
-        entries = list_entries(session, current_path)
+        entries = list_entries(session, current_path, config, mounts)
         return render_template(
             "partials/action_result.html",
             current_path=current_path,
-            entries=entries,
+            **list_page(entries),
             status="Items copied",
             status_level="success",
         )
@@ -285,28 +326,24 @@ def create_app() -> Flask:
         current_path = normalize_path(request.args.get("path", "/"))
         selected_paths = request.form.getlist("selected_paths")
         if not selected_paths:
-            return render_template(
-                "partials/status.html", status="Select at least one item to delete", status_level="error"
-            )
+            return status_errors["Select at least one item to delete"]
 
-        sources = [
-            normalize_path(path if path.startswith("/") else f"{current_path.rstrip('/')}/{path}")
-            for path in selected_paths
-        ]
-        adapter = get_adapter(session.data["vault_path"])
+        sources = [normalize_path(join_path(current_path, path)) for path in selected_paths]
+        adapter = session_adapter(session, config)
         try:
-            with adapter.open(session.data["passphrase"]) as root:
+            root = mounts.acquire(session)
+            with vault_write(session):
                 for source_path in sources:
                     adapter.delete_entry(root, source_path)
+                    update_index_after_delete(session, source_path)
         except VaultAdapterError as exc:
             return render_template("partials/status.html", status=str(exc), status_level="error")
 
-        refresh_index(session)
-        entries = list_entries(session, current_path)
+        entries = list_entries(session, current_path, config, mounts)
         return render_template(
             "partials/action_result.html",
             current_path=current_path,
-            entries=entries,
+            **list_page(entries),
             status="Items deleted",
             status_level="success",
         )
@@ -315,7 +352,7 @@ def create_app() -> Flask:
     def hx_picker() -> str:
         session = request.session
         path = normalize_path(request.args.get("path", "/"))
-        entries = list_entries(session, path)
+        entries = list_entries(session, path, config, mounts)
         directories = [entry for entry in entries if entry.is_dir]
         return render_template(
             "partials/destination_picker.html",
@@ -328,85 +365,149 @@ def create_app() -> Flask:
     def download() -> Response:
         session = request.session
         path = normalize_path(request.args.get("path", "/"))
-        adapter = get_adapter(session.data["vault_path"])
+        adapter = session_adapter(session, config)
         try:
-            with adapter.open(session.data["passphrase"]) as root:
-                handle = adapter.open_file(root, path)
-                return send_file(
-                    handle,
-                    as_attachment=True,
-                    download_name=path.split("/")[-1],
-                )
+            root = mounts.acquire(session)
+            # Passing the path (not a file object) lets the server stream it
+            # with sendfile and gives send_file the size/mtime for range and
+            # conditional requests.
+            return send_file(
+                adapter.file_path(root, path),
+                as_attachment=True,
+                download_name=path.split("/")[-1],
+                conditional=True,
+            )
         except VaultAdapterError as exc:
             abort(404, description=str(exc))
 
     @app.get("/api/v1/fs/list")
-    def api_list() -> dict[str, Any]:
+    def api_list() -> Response:
         session = request.session
         path = normalize_path(request.args.get("path", "/"))
-        entries = list_entries(session, path)
-        return {"path": path, "entries": [asdict(entry) for entry in entries]}
+        entries = list_entries(session, path, config, mounts)
+
+        def render() -> bytes:
+            if isinstance(entries, IndexBucket):
+                rows = entries.to_dicts()
+            else:
+                rows = [entry.to_dict() for entry in entries]
+            return orjson.dumps({"path": path, "entries": rows})
+
+        return conditional_response(listing_etag(path, entries, "api"), render, mimetype="application/json")
 
     return app
 
 
-def list_entries(session: Any, path: str) -> list[DirEntry]:
-    if session.data.get("index"):
-        return session.data["index"].get(path, [])
-    adapter = get_adapter_for_session(session)
+def list_entries(session: Any, path: str, config: AppConfig, mounts: MountManager) -> Sequence[DirEntry]:
+    index = session.data.get("index")
     try:
-        with adapter.open(session.data["passphrase"]) as root:
-            return adapter.list_dir(root, path)
+        if index:
+            return index.get(path, directory_loader(session, config, mounts))
+        return directory_loader(session, config, mounts, sort=True)(path)
     except VaultAdapterError:
         return []
 
 
-def build_tree_from_index(index: dict[str, list[DirEntry]]) -> dict:
-    return build_tree(index, "/")
+def directory_loader(
+    session: Any, config: AppConfig, mounts: MountManager, sort: bool = False
+) -> Callable[[str], list[DirEntry]]:
+    # Unsorted by default: listings that feed an IndexBucket are sorted there.
+    adapter = session_adapter(session, config)
+    return lambda path: adapter.list_dir(mounts.acquire(session), path, sort=sort)
+
+
+def list_page(entries: Sequence[DirEntry], offset: int = 0, limit: int = LIST_PAGE_SIZE) -> dict[str, Any]:
+    end = offset + limit
+    return {"entries": entries[offset:end], "next_offset": end if end < len(entries) else None, "limit": limit}
+
+
+def listing_etag(path: str, entries: Sequence[DirEntry], *variant: Any) -> str:
+    digest = hashlib.blake2b(repr((path, variant)).encode("utf-8"), digest_size=16)
+    if isinstance(entries, IndexBucket):
+        digest.update("\0".join(entries.names).encode("utf-8"))
+        digest.update(entries.is_dir)
+        digest.update(entries.sizes.tobytes())
+    else:
+        for entry in entries:
+            digest.update(f"{entry.name}|{entry.size}|{entry.is_dir}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def conditional_response(etag: str, render: Callable[[], str | bytes], mimetype: str) -> Response:
+    # Unchanged listings are answered with 304 before anything is rendered.
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(render(), mimetype=mimetype)
+    response.set_etag(etag)
+    # Listings are per session and change with every write: always revalidate.
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def build_tree_from_index(index: SessionIndex, load: Callable[[str], list[DirEntry]]) -> dict:
+    # The sidebar only shows the root's subfolders, so only the root bucket is
+    # read; deeper directories are listed when navigated to.
+    try:
+        root = index.get("/", load)
+    except VaultAdapterError:
+        root = []
+    return build_tree({"/": root}, "/")
 
 
 def update_index_after_upload(session: Any, folder_path: str, filename: str) -> None:
     index = session.data.get("index")
     if not index:
         return
-    new_entry = DirEntry(name=filename, path=f"{folder_path.rstrip('/')}/{filename}", is_dir=False, size=None)
-    entries = index.setdefault(folder_path, [])
-    entries.append(new_entry)
-    entries.sort(key=lambda item: (not item.is_dir, item.name.lower()))
+    index.add(folder_path, DirEntry(name=filename, path=join_path(folder_path, filename), is_dir=False, size=None))
 
 
 def update_index_after_mkdir(session: Any, folder_path: str, folder_name: str) -> None:
     index = session.data.get("index")
     if not index:
         return
-    new_entry = DirEntry(name=folder_name, path=f"{folder_path.rstrip('/')}/{folder_name}", is_dir=True, size=None)
-    entries = index.setdefault(folder_path, [])
-    entries.append(new_entry)
-    entries.sort(key=lambda item: (not item.is_dir, item.name.lower()))
-    index.setdefault(new_entry.path, [])
+    new_entry = DirEntry(name=folder_name, path=join_path(folder_path, folder_name), is_dir=True, size=None)
+    index.add(folder_path, new_entry)
+    index.put(new_entry.path, IndexBucket(new_entry.path))
 
 
-def refresh_index(session: Any) -> None:
-    if not session.data.get("index"):
-        return
-    adapter = get_adapter_for_session(session)
-    try:
-        session.data["index"] = adapter.build_index(session.data["passphrase"])
-    except VaultAdapterError:
-        session.data["index"] = None
+def update_index_after_move(session: Any, source_path: str, destination_dir: str) -> None:
+    index = session.data.get("index")
+    if index:
+        index.move(source_path, destination_dir)
 
 
-def get_adapter_for_session(session: Any) -> VaultAdapter:
-    config = load_config()
+def update_index_after_copy(session: Any, source_path: str, destination_dir: str) -> None:
+    index = session.data.get("index")
+    if index:
+        index.copy(source_path, destination_dir)
+
+
+def update_index_after_delete(session: Any, source_path: str) -> None:
+    index = session.data.get("index")
+    if index:
+        index.remove(source_path)
+
+
+def session_adapter(session: Any, config: AppConfig) -> VaultAdapter:
+    if session.adapter is None:
+        session.adapter = get_adapter(config, session.data["vault_path"])
+    return session.adapter
+
+
+def get_adapter(config: AppConfig, vault_path: str) -> VaultAdapter:
     if config.adapter == "cli":
         return CLIVaultAdapter(
-            vault_path=Path(session.data["vault_path"]),
+            vault_path=Path(vault_path),
             cli_path=config.cryptomator_cli_path,
             mount_root=config.vault_mount_root,
             mounter=config.mounter,
             umount_cli_path=config.umount_cli_path,
+            index_workers=config.index_workers,
+            mount_timeout_seconds=config.mount_timeout_seconds,
         )
-    return PyVaultAdapter(Path(session.data["vault_path"]))
+    return PyVaultAdapter(Path(vault_path), index_workers=config.index_workers)
 
 if __name__ == "__main__":
     flask_app = create_app()
@@ -0,0 +1,101 @@
+import hashlib
+import logging
+import os
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+from typing import Callable
+
+from app.adapters import VaultAdapter, VaultAdapterError
+from app.session import SessionData
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Mount:
+    lock: Lock = field(default_factory=Lock)
+    stack: ExitStack | None = None
+    root: Path | None = None
+    sessions: set[str] = field(default_factory=set)
+
+
+class MountManager:
+    """Keeps opened vaults across requests, shared by sessions of the same unlock."""
+
+    def __init__(self, adapter_factory: Callable[[SessionData], VaultAdapter]) -> None:
+        self.adapter_factory = adapter_factory
+        self._lock = Lock()
+        # Keyed by vault and passphrase digest: a session only joins a mount
+        # that was unlocked with the same passphrase it logged in with.
+        self._mounts: dict[tuple[str, str], _Mount] = {}
+        self._session_keys: dict[str, tuple[str, str]] = {}
+
+    def acquire(self, session: SessionData) -> Path:
+        passphrase = session.data["passphrase"]
+        key = (session.data["vault_path"], hashlib.sha256(passphrase.encode("utf-8")).hexdigest())
+        with self._lock:
+            # A request still in flight when its session ended must not register
+            # it again: nothing would release the mount afterwards.
+            if not session.active:
+                raise VaultAdapterError("Session has ended")
+            mount = self._mounts.setdefault(key, _Mount())
+            mount.sessions.add(session.session_id)
+            self._session_keys[session.session_id] = key
+        # Mounting can take seconds; only requests for the same mount wait for it.
+        with mount.lock:
+            with self._lock:
+                released = session.session_id not in mount.sessions
+            if released:
+                raise VaultAdapterError("Session has ended")
+            if mount.root is not None and not _alive(mount.root):
+                # The CLI process went away (ENOTCONN and the like): clean up
+                # what is left and mount again instead of failing until expiry.
+                logger.warning("Vault mount %s is no longer reachable, remounting", mount.root)
+                _close(mount)
+            if mount.root is None:
+                adapter = self.adapter_factory(session)
+                stack = ExitStack()
+                mount.root = stack.enter_context(adapter.open(passphrase))
+                mount.stack = stack
+            return mount.root
+
+    def release(self, session_id: str) -> None:
+        with self._lock:
+            key = self._session_keys.pop(session_id, None)
+            if key is None:
+                return
+            mount = self._mounts[key]
+            mount.sessions.discard(session_id)
+            if mount.sessions:
+                return
+            del self._mounts[key]
+        with mount.lock:
+            _close(mount)
+
+    def release_all(self) -> None:
+        with self._lock:
+            session_ids = list(self._session_keys)
+        for session_id in session_ids:
+            self.release(session_id)
+
+
+def _alive(root: Path) -> bool:
+    try:
+        os.stat(root)
+    except OSError:
+        return False
+    return True
+
+
+def _close(mount: _Mount) -> None:
+    # Called on logout, expiry and exit: a failed unmount is logged, not raised.
+    try:
+        if mount.stack is not None:
+            mount.stack.close()
+    except Exception:
+        logger.exception("Failed to close vault mount %s", mount.root)
+    finally:
+        mount.stack = None
+        mount.root = None
@@ -1,12 +1,23 @@
 import subprocess
-import time
+import tempfile
 
 
-def start_background_process(cmd):
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    time.sleep(2)  # Wait 2 seconds
-    retcode = process.poll()
-    if retcode is not None and retcode != 0:
-        stdout, stderr = process.communicate()
-        raise RuntimeError(f"Process failed with code {retcode}: {stderr.decode()}")
-    return process  # Still running in background
\ No newline at end of file
+def start_background_process(cmd, startup_seconds=2):
+    # stderr goes to a temporary file rather than a pipe: nothing drains a pipe
+    # while the process runs, and a full pipe buffer would block it.
+    stderr = tempfile.TemporaryFile()
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=stderr)
+    process.stderr_log = stderr
+    try:
+        retcode = process.wait(timeout=startup_seconds)  # Returns as soon as a failing process exits
+    except subprocess.TimeoutExpired:
+        return process  # Still running in background
+    if retcode != 0:
+        raise RuntimeError(f"Process failed with code {retcode}: {read_stderr(process)}")
+    return process
+
+
+def read_stderr(process):
+    stderr = process.stderr_log
+    stderr.seek(0)
+    return stderr.read().decode(errors="replace")
@@ -1,22 +1,48 @@
 import time
-from collections import deque
+from array import array
 from threading import Lock
 
+from cachetools import TTLCache
+
+LOCK_STRIPES = 64
+MAX_TRACKED_KEYS = 10_000
+
+
+class _Window:
+    __slots__ = ("times", "oldest")
+
+    def __init__(self, size: int) -> None:
+        # Ring buffer of the last `size` allowed attempts; `oldest` points at
+        # the earliest one, which is the next slot to overwrite.
+        self.times = array("d", [float("-inf")] * size)
+        self.oldest = 0
+
 
 class RateLimiter:
-    def __init__(self, max_attempts: int, window_seconds: int) -> None:
+    def __init__(self, max_attempts: int, window_seconds: int, max_keys: int = MAX_TRACKED_KEYS) -> None:
         self.max_attempts = max_attempts
         self.window_seconds = window_seconds
-        self._lock = Lock()
-        self._attempts: dict[str, deque[float]] = {}
+        # Keys are spread over a fixed set of locks so unrelated clients do
+        # not contend on a single one. Each stripe owns a bounded shard, and a
+        # key is forgotten once its last attempt has left the window.
+        self._locks = [Lock() for _ in range(LOCK_STRIPES)]
+        shard_size = -(-max_keys // LOCK_STRIPES)
+        self._attempts: list[TTLCache[str, _Window]] = [
+            TTLCache(maxsize=shard_size, ttl=window_seconds, timer=time.monotonic) for _ in range(LOCK_STRIPES)
+        ]
 
     def allow(self, key: str) -> bool:
-        now = time.time()
-        with self._lock:
-            attempts = self._attempts.setdefault(key, deque())
-            while attempts and now - attempts[0] > self.window_seconds:
-                attempts.popleft()
-            if len(attempts) >= self.max_attempts:
+        now = time.monotonic()
+        stripe = hash(key) % LOCK_STRIPES
+        with self._locks[stripe]:
+            attempts = self._attempts[stripe]
+            window = attempts.get(key)
+            if window is None:
+                window = _Window(self.max_attempts)
+            elif now - window.times[window.oldest] <= self.window_seconds:
                 return False
-            attempts.append(now)
+            window.times[window.oldest] = now
+            window.oldest = (window.oldest + 1) % self.max_attempts
+            # Re-set to restart the entry's TTL from this attempt.
+            attempts[key] = window
             return True
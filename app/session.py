@@ -1,26 +1,45 @@
+import logging
 import secrets
 import time
 from dataclasses import dataclass, field
-from threading import Lock
-from typing import Any
+from threading import Lock, Thread
+from typing import Any, Callable
 
 from itsdangerous import BadSignature, Signer
 
+from app.adapters import VaultAdapter
 
-@dataclass
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
 class SessionData:
     session_id: str
     created_at: float
     last_access: float
     data: dict[str, Any] = field(default_factory=dict)
+    # Built on first use and reused by every request of the session.
+    adapter: VaultAdapter | None = field(default=None, repr=False)
+    # Cleared once the session is removed from the store.
+    active: bool = True
 
 
 class SessionStore:
-    def __init__(self, secret_key: str, ttl_seconds: int) -> None:
+    def __init__(
+        self,
+        secret_key: str,
+        ttl_seconds: int,
+        on_remove: Callable[[SessionData], None] | None = None,
+    ) -> None:
         self.signer = Signer(secret_key)
         self.ttl_seconds = ttl_seconds
+        self.on_remove = on_remove
         self._lock = Lock()
         self._sessions: dict[str, SessionData] = {}
+        # Sessions of clients that never come back are only noticed by get();
+        # sweep them periodically so they do not accumulate.
+        self._janitor = Thread(target=self._sweep_forever, name="session-janitor", daemon=True)
+        self._janitor.start()
 
     def _now(self) -> float:
         return time.time()
@@ -47,15 +66,56 @@ class SessionStore:
             session = self._sessions.get(session_id)
             if not session:
                 return None
-            if self._expired(session):
-                self._sessions.pop(session_id, None)
-                return None
-            session.last_access = self._now()
-            return session
+            if not self._expired(session):
+                session.last_access = self._now()
+                return session
+            self._sessions.pop(session_id, None)
+        self._removed(session)
+        return None
 
     def destroy(self, session_id: str) -> None:
         with self._lock:
-            self._sessions.pop(session_id, None)
+            session = self._sessions.pop(session_id, None)
+        if session:
+            self._removed(session)
+
+    def sweep(self) -> None:
+        with self._lock:
+            snapshot = list(self._sessions.items())
+        candidates = [session_id for session_id, session in snapshot if self._expired(session)]
+        if not candidates:
+            return
+        removed = []
+        with self._lock:
+            for session_id in candidates:
+                session = self._sessions.get(session_id)
+                # Re-checked: the session may have been used since the snapshot.
+                if session and self._expired(session):
+                    del self._sessions[session_id]
+                    removed.append(session)
+        for session in removed:
+            self._removed(session)
+
+    def _sweep_forever(self) -> None:
+        interval = max(1, self.ttl_seconds // 10)
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Session sweep failed")
+
+    def _removed(self, session: SessionData) -> None:
+        # Called outside the lock: cleanup (e.g. unmounting) may be slow.
+        session.active = False
+        if not self.on_remove:
+            return
+        # A failed cleanup (e.g. an unmount error) is logged so it neither
+        # fails the request nor stops the sweeper or the rest of its batch.
+        try:
+            self.on_remove(session)
+        except Exception:
+            logger.exception("Cleanup of session %s failed", session.session_id)
 
     def sign(self, session_id: str) -> str:
         return self.signer.sign(session_id).decode("utf-8")
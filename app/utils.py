@@ -1,4 +1,4 @@
-from pathlib import PurePosixPath
+from typing import Mapping, Sequence
 
 from app.adapters import DirEntry
 
@@ -6,40 +6,52 @@ from app.adapters import DirEntry
 def normalize_path(raw_path: str) -> str:
     if not raw_path:
         return "/"
-    if not raw_path.startswith("/"):
-        raw_path = f"/{raw_path}"
-    normalized = str(PurePosixPath(raw_path))
-    if ".." in PurePosixPath(normalized).parts:
+    parts = [part for part in raw_path.split("/") if part and part != "."]
+    if ".." in parts:
         raise ValueError("Invalid path traversal")
-    return normalized
+    return "/" + "/".join(parts)
 
 
-def build_tree(entries_by_path: dict[str, list[DirEntry]], root: str = "/") -> dict:
-    def build_node(path: str) -> dict:
-        children = []
-        for entry in entries_by_path.get(path, []):
-            if entry.is_dir:
-                children.append(build_node(entry.path))
-        return {"path": path, "children": children}
+def join_path(parent: str, name: str) -> str:
+    # An absolute `name` stands on its own; `parent` is a normalized path, so
+    # only the root ends with a slash.
+    if name.startswith("/"):
+        return name
+    return f"/{name}" if parent == "/" else f"{parent}/{name}"
+
 
-    return build_node(root)
+def build_tree(entries_by_path: Mapping[str, Sequence[DirEntry]], root: str = "/") -> dict:
+    # Iterative so deep vaults neither recurse per level nor hit the recursion limit.
+    tree = {"path": root, "children": []}
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        for entry in entries_by_path.get(node["path"], []):
+            if entry.is_dir:
+                child = {"path": entry.path, "children": []}
+                node["children"].append(child)
+                stack.append(child)
+    return tree
 
 
 def flatten_tree(tree: dict) -> list[dict]:
-    items = [tree]
-    for child in tree.get("children", []):
-        items.extend(flatten_tree(child))
+    items = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        items.append(node)
+        # Reversed so children come off the stack in their original order.
+        stack.extend(reversed(node.get("children", [])))
     return items
 
 
 def build_breadcrumbs(path: str) -> list[dict]:
     normalized = normalize_path(path)
-    if normalized == "/":
-        return [{"name": "/", "path": "/"}]
-    parts = PurePosixPath(normalized).parts
     breadcrumbs = [{"name": "/", "path": "/"}]
-    current = PurePosixPath("/")
-    for part in parts[1:]:
-        current = current / part
-        breadcrumbs.append({"name": part, "path": str(current)})
+    if normalized == "/":
+        return breadcrumbs
+    current = ""
+    for part in normalized[1:].split("/"):
+        current = f"{current}/{part}"
+        breadcrumbs.append({"name": part, "path": current})
     return breadcrumbs